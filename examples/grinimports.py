@@ -3,29 +3,33 @@
 """ Transform Python files into normalized import statements for grepping.
 """
 
-import compiler
-from compiler.visitor import ASTVisitor, walk
+import ast
 from cStringIO import StringIO
+import hashlib
 import os
-import shlex
 import sys
+import tempfile
 
 import grin
 
 
 __version__ = '1.2'
 
+# Default location of the on-disk cache of normalized import statements.
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'grin',
+    'imports')
+
+
 def normalize_From(node):
     """ Return a list of strings of Python 'from' statements, one import on each
     line.
     """
     statements = []
-    children = node.getChildren()
-    module = '.'*node.level + node.modname
-    for name, asname in children[1]:
-        line = 'from %s import %s' % (module, name)
-        if asname is not None:
-            line += ' as %s' % asname
+    module = '.'*(node.level or 0) + (node.module or '')
+    for alias in node.names:
+        line = 'from %s import %s' % (module, alias.name)
+        if alias.asname is not None:
+            line += ' as %s' % alias.asname
         line += '\n'
         statements.append(line)
     return statements
@@ -35,26 +39,27 @@ def normalize_Import(node):
     each line.
     """
     statements = []
-    children = node.getChildren()
-    for name, asname in children[0]:
-        line = 'import %s' % (name)
-        if asname is not None:
-            line += ' as %s' % asname
+    for alias in node.names:
+        line = 'import %s' % (alias.name)
+        if alias.asname is not None:
+            line += ' as %s' % alias.asname
         line += '\n'
         statements.append(line)
     return statements
 
-class ImportPuller(ASTVisitor):
+class ImportPuller(ast.NodeVisitor):
     """ Extract import statements from an AST.
+
+    Nodes are visited depth first, so the statements come out in source order.
     """
     def __init__(self):
-        ASTVisitor.__init__(self)
+        ast.NodeVisitor.__init__(self)
         self.statements = []
 
-    def visitFrom(self, node):
+    def visit_ImportFrom(self, node):
         self.statements.extend(normalize_From(node))
 
-    def visitImport(self, node):
+    def visit_Import(self, node):
         self.statements.extend(normalize_Import(node))
 
     def as_string(self):
@@ -63,18 +68,157 @@ class ImportPuller(ASTVisitor):
         return ''.join(self.statements)
 
 
-def normalize_file(filename, *args):
-    """ Import-normalize a file.
+def read_file(filename):
+    """ Read the whole contents of a file.
+    """
+    f = open(filename, 'rb')
+    try:
+        return f.read()
+    finally:
+        f.close()
 
-    If the file is not parseable, an empty filelike object will be returned.
+def normalize_source(source, filename='<unknown>'):
+    """ Parse Python source and return its normalized import statements as
+    a string.
+
+    If the source is not parseable, an empty string will be returned.
     """
     try:
-        ast = compiler.parseFile(filename)
+        tree = ast.parse(source, filename)
     except Exception, e:
-        return StringIO('')
+        return ''
     ip = ImportPuller()
-    walk(ast, ip)
-    return StringIO(ip.as_string())
+    ip.visit(tree)
+    return ip.as_string()
+
+def normalize_text(filename):
+    """ Parse a file and return its normalized import statements as a string.
+
+    If the file is not readable or parseable, an empty string will be returned.
+    """
+    try:
+        source = read_file(filename)
+    except Exception, e:
+        return ''
+    return normalize_source(source, filename)
+
+def normalize_file(filename, *args):
+    """ Import-normalize a file.
+
+    If the file is not parseable, an empty filelike object will be returned.
+    """
+    return StringIO(normalize_text(filename))
+
+
+class CachedNormalizer(object):
+    """ Import-normalize files, caching the results on disk.
+
+    Entries are keyed by the absolute path, modification time and size of the
+    file, so unchanged files are not parsed again on later runs. Results are
+    also kept in memory for the life of the object, both by that key and by
+    the hash of the source itself, so identical copies of a file are only
+    parsed once.
+
+    Attributes
+    ----------
+    cache_dir : str
+        The directory holding the cache entries.
+    memory_size : int
+        The maximum number of entries to keep in each in-memory cache.
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, memory_size=4096):
+        self.cache_dir = cache_dir
+        self.memory_size = memory_size
+        # Map cache paths to normalized text.
+        self._by_path = {}
+        # Map hashes of the source to normalized text.
+        self._by_source = {}
+
+    def _remember(self, memo, key, text):
+        """ Store an entry in one of the in-memory caches, starting over if it
+        is full.
+        """
+        if len(memo) >= self.memory_size:
+            memo.clear()
+        memo[key] = text
+
+    def normalize(self, filename):
+        """ Normalize a file that is in neither the on-disk nor the in-memory
+        cache.
+
+        Returns None if the file cannot be read.
+        """
+        try:
+            source = read_file(filename)
+        except Exception, e:
+            return None
+        digest = hashlib.sha1(source).digest()
+        text = self._by_source.get(digest)
+        if text is None:
+            text = normalize_source(source, filename)
+            self._remember(self._by_source, digest, text)
+        return text
+
+    def cache_path(self, filename):
+        """ Return the path of the cache entry for a file.
+
+        Raises
+        ------
+        OSError if the file cannot be stat'ed.
+        """
+        path = os.path.abspath(filename)
+        st = os.stat(path)
+        key = hashlib.sha1('%s\0%r\0%s' % (path, st.st_mtime, st.st_size)).hexdigest()
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    def write_entry(self, cache_path, text):
+        """ Atomically write a cache entry. Failures are ignored since the cache
+        is only an optimization.
+        """
+        dirname = os.path.dirname(cache_path)
+        try:
+            if not os.path.isdir(dirname):
+                os.makedirs(dirname)
+            fd, tmp_path = tempfile.mkstemp(dir=dirname)
+        except (OSError, IOError):
+            return
+        try:
+            f = os.fdopen(fd, 'wb')
+            try:
+                f.write(text)
+            finally:
+                f.close()
+            os.rename(tmp_path, cache_path)
+        except (OSError, IOError):
+            # Do not leave the partial entry behind.
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+
+    def __call__(self, filename, mode='rb'):
+        """ Return a filelike object with the normalized import statements of
+        a file.
+        """
+        try:
+            cache_path = self.cache_path(filename)
+        except OSError:
+            return normalize_file(filename)
+        text = self._by_path.get(cache_path)
+        if text is None:
+            try:
+                text = read_file(cache_path)
+            except IOError:
+                text = self.normalize(filename)
+                if text is None:
+                    # The file may become readable without changing its key,
+                    # so do not remember the failure.
+                    return StringIO('')
+                self.write_entry(cache_path, text)
+            self._remember(self._by_path, cache_path, text)
+        return StringIO(text)
+
 
 def get_grinimports_arg_parser(parser=None):
     """ Create the command-line parser.
@@ -124,12 +268,18 @@ the import statements are not normalized.
         if hasattr(action, 'version'):
             action.version = 'grinpython %s' % __version__
 
+    group = parser.add_argument_group('Import Cache')
+    group.add_argument('--cache-dir', default=os.getenv('GRIN_CACHE_DIR',
+        DEFAULT_CACHE_DIR),
+        help="directory to cache normalized imports in [default=%(default)r]")
+    group.add_argument('--no-cache', action='store_true',
+        help="do not cache normalized imports")
     return parser
 
 def grinimports_main(argv=None):
     if argv is None:
         # Look at the GRIN_ARGS environment variable for more arguments.
-        env_args = shlex.split(os.getenv('GRIN_ARGS', ''))
+        env_args = grin.get_env_args('GRIN_ARGS')
         argv = [sys.argv[0]] + env_args + sys.argv[1:]
     parser = get_grinimports_arg_parser()
     args = parser.parse_args(argv[1:])
@@ -142,11 +292,14 @@ def grinimports_main(argv=None):
 
     regex = grin.get_regex(args)
     g = grin.GrepText(regex, args)
-    for filename, kind in grin.get_filenames(args):
-        if kind == 'text':
-            # Ignore gzipped files.
-            report = g.grep_a_file(filename, opener=normalize_file)
-            sys.stdout.write(report)
+    if args.no_cache:
+        opener = normalize_file
+    else:
+        opener = CachedNormalizer(args.cache_dir)
+    # Ignore gzipped files.
+    reports = (g.grep_a_file(filename, opener=opener)
+        for filename, kind in grin.get_filenames(args) if kind == 'text')
+    grin.write_reports(reports)
 
 if __name__ == '__main__':
     grinimports_main()
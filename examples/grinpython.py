@@ -5,7 +5,6 @@
 
 from cStringIO import StringIO
 import os
-import shlex
 import string
 import sys
 import tokenize
@@ -56,21 +55,26 @@ class Transformer(object):
         contents.
         """
         g = StringIO()
+        # Bind the methods used for every token to locals.
+        write = g.write
+        keep_token = self.keep_token
+        replace_with_spaces = self.replace_with_spaces
         f = open(filename, mode)
         try:
             gen = tokenize.generate_tokens(f.readline)
-            old_end = (1, 0)
-            for kind, token, start, end, line in gen:
-                if old_end[0] == start[0]:
-                    dx = start[1] - old_end[1]
+            old_row, old_col = 1, 0
+            for kind, token, (row, col), (end_row, end_col), line in gen:
+                if old_row == row:
+                    dx = col - old_col
                 else:
-                    dx = start[1]
+                    dx = col
                 # Put in any omitted whitespace.
-                g.write(' ' * dx)
-                old_end = end
-                if not self.keep_token(kind):
-                    token = self.replace_with_spaces(token)
-                g.write(token)
+                if dx:
+                    write(' ' * dx)
+                old_row, old_col = end_row, end_col
+                if not keep_token(kind):
+                    token = replace_with_spaces(token)
+                write(token)
         finally:
             f.close()
         # Seek back to the beginning of the file.
@@ -100,7 +104,7 @@ def get_grinpython_arg_parser(parser=None):
 def grinpython_main(argv=None):
     if argv is None:
         # Look at the GRIN_ARGS environment variable for more arguments.
-        env_args = shlex.split(os.getenv('GRIN_ARGS', ''))
+        env_args = grin.get_env_args('GRIN_ARGS')
         argv = [sys.argv[0]] + env_args + sys.argv[1:]
     parser = get_grinpython_arg_parser()
     args = parser.parse_args(argv[1:])
@@ -115,11 +119,10 @@ def grinpython_main(argv=None):
 
     regex = grin.get_regex(args)
     g = grin.GrepText(regex, args)
-    for filename, kind in grin.get_filenames(args):
-        if kind == 'text':
-            # Ignore gzipped files.
-            report = g.grep_a_file(filename, opener=xform)
-            sys.stdout.write(report)
+    # Ignore gzipped files.
+    reports = (g.grep_a_file(filename, opener=xform)
+        for filename, kind in grin.get_filenames(args) if kind == 'text')
+    grin.write_reports(reports)
 
 if __name__ == '__main__':
     grinpython_main()
@@ -2,18 +2,31 @@
 """ grin searches text files.
 """
 
-import bisect
+import collections
 import fnmatch
 import gzip
 import itertools
+import multiprocessing
 import os
 import re
 import shlex
+import signal
+import sre_constants
+import sre_parse
 import stat
 import sys
 
 import argparse
 
+try:
+    from os import scandir
+except ImportError:
+    try:
+        # The backport of os.scandir() for Python 2.
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
 
 #### Constants ####
 __version__ = '1.2.1'
@@ -23,23 +36,79 @@ PRE = -1
 MATCH = 0
 POST = 1
 
+# The symbols separating the line numbers from the lines of each kind.
+SEP_SYMBOLS = {PRE: '-', POST: '+', MATCH: ':'}
+
 # Use file(1)'s choices for what's text and what's not.
-TEXTCHARS = ''.join(map(chr, [7,8,9,10,12,13,27] + range(0x20, 0x100)))
-ALLBYTES = ''.join(map(chr, range(256)))
+TEXTCHARS = bytes(bytearray([7,8,9,10,12,13,27] + list(range(0x20, 0x100))))
 
 COLOR_TABLE = ['black', 'red', 'green', 'yellow', 'blue', 'magenta', 'cyan',
                'white', 'default']
+# The ANSI codes for each color. Foreground colors go from 30-39 and
+# background colors from 40-49.
+FG_CODES = dict((color, i + 30) for i, color in enumerate(COLOR_TABLE))
+BG_CODES = dict((color, i + 40) for i, color in enumerate(COLOR_TABLE))
 COLOR_STYLE = {
         'filename': dict(fg="green", bold=True),
         'searchterm': dict(fg="black", bg="yellow"),
         }
+# The escape sequence that resets the style.
+STYLE_END = '\x1b[0m'
 
 # gzip magic header bytes.
 GZIP_MAGIC = '\037\213'
 
+# Extensions of files that are known to be text or binary without having to
+# read them.
+KNOWN_TEXT_EXTS = frozenset(['.py', '.pyx', '.pxd', '.c', '.h', '.cpp', '.hpp',
+    '.cxx', '.cc', '.f', '.f90', '.java', '.js', '.rb', '.pl', '.sh', '.txt',
+    '.rst', '.md', '.html', '.css', '.xml', '.json', '.yaml', '.yml', '.ini',
+    '.cfg', '.toml'])
+KNOWN_BINARY_EXTS = frozenset(['.png', '.jpg', '.jpeg', '.gif', '.bmp', '.tif',
+    '.tiff', '.pdf', '.zip', '.tar', '.exe', '.dll', '.dylib', '.so', '.o',
+    '.a', '.class', '.jar'])
+
 # Target amount of data to read into memory at a time.
 READ_BLOCKSIZE = 16 * 1024 * 1024
 
+# The functions to open each kind of file that can be grepped.
+OPENERS = dict(text=open, gzip=gzip.open)
+
+# Amount of data to read at a time from a file of NUL-separated filenames.
+FILES_BLOCKSIZE = 64 * 1024
+
+# Target amount of report text to write to stdout at a time when it is not a
+# terminal.
+WRITE_BLOCKSIZE = 64 * 1024
+
+# Number of files handed to a worker process at a time with --jobs.
+JOBS_CHUNKSIZE = 32
+
+# Seconds to wait on the --jobs workers at a time. Python 2 cannot interrupt a
+# wait without a timeout, so Ctrl-C would never get through.
+JOBS_WAIT_TIMEOUT = 0.1
+
+# The filenames that are empty or name the null device outside of Windows.
+NULL_FILENAMES = frozenset(['', '/dev/null'])
+
+
+# The kinds of files recognized by FileRecognizer that can be grepped.
+GREP_KINDS = frozenset(['text', 'gzip'])
+
+# Names of the modules that may be used to compile the regex. Each must
+# provide the same compile() API as the standard library's re module.
+REGEX_ENGINES = ['re', 'regex', 're2']
+
+# The type of the compiled regexes from the re module.
+RE_PATTERN_TYPE = type(re.compile(''))
+
+# Compiled regexes keyed by (engine, type of pattern, pattern, flags). The re
+# module keeps its own cache, but it is small, and other engines may not cache
+# at all. Like re's, this one is thrown away whole when it fills up so that
+# long-running programs compiling many patterns do not grow without bound.
+_REGEX_CACHE = {}
+_REGEX_CACHE_MAX = 512
+
 
 def is_binary_string(bytes):
     """ Determine if a string is classified as binary rather than text.
@@ -52,14 +121,146 @@ def is_binary_string(bytes):
     -------
     is_binary : bool
     """
-    nontext = bytes.translate(ALLBYTES, TEXTCHARS)
+    # Deleting the text characters needs no translation table.
+    nontext = bytes.translate(None, TEXTCHARS)
     return bool(nontext)
     
+if os.altsep is None:
+    def path_basename(path):
+        """ Return the final component of a path.
+
+        With a single path separator, this is the same as os.path.basename()
+        but cheaper.
+        """
+        return path.rpartition(os.sep)[2]
+else:
+    path_basename = os.path.basename
+
+if sys.platform == 'win32':
+    def is_empty_or_null_filename(filename):
+        """ Check if a filename is empty or names the null device.
+        """
+        # Only short names can be the null device, so most filenames are not
+        # uppercased at all.
+        return (not filename or
+            (len(filename) <= 4 and filename.upper() in ('NUL', 'NUL:')))
+else:
+    def is_empty_or_null_filename(filename):
+        """ Check if a filename is empty or names the null device.
+        """
+        return filename in NULL_FILENAMES
+
+def basename_ext(basename):
+    """ Return the extension of a basename, including the leading '.'.
+
+    This is the same as os.path.splitext(basename)[1]: leading dots do not start
+    an extension, and the extension is empty if there is none.
+    """
+    i = basename.rfind('.')
+    if i <= 0 or not basename[:i].lstrip('.'):
+        return ''
+    return basename[i:]
+
+def get_regex_engine(name='re'):
+    """ Get the module implementing a regex engine.
+
+    Parameters
+    ----------
+    name : str
+        One of REGEX_ENGINES.
+
+    Returns
+    -------
+    engine : module
+        A module with an re-compatible compile() function.
+
+    Raises
+    ------
+    ImportError if the engine is not installed.
+    """
+    if name == 're':
+        return re
+    try:
+        return __import__(name)
+    except ImportError:
+        raise ImportError('The %r regex engine is not installed.' % name)
+
+def compile_regex(pattern, flags=0, engine='re'):
+    """ Compile a regex with the named engine, reusing an earlier compilation
+    of the same pattern and flags if there is one.
+
+    Patterns using constructs that the engine does not support (e.g.
+    backreferences and lookarounds with re2) are compiled with re instead.
+    """
+    # 'foo' and u'foo' are equal, but compile to different regexes.
+    key = (engine, type(pattern), pattern, flags)
+    try:
+        return _REGEX_CACHE[key]
+    except KeyError:
+        pass
+    module = get_regex_engine(engine)
+    try:
+        regex = module.compile(pattern, flags)
+    except getattr(module, 'error', re.error):
+        if module is re:
+            raise
+        regex = re.compile(pattern, flags)
+    if len(_REGEX_CACHE) >= _REGEX_CACHE_MAX:
+        _REGEX_CACHE.clear()
+    _REGEX_CACHE[key] = regex
+    return regex
+
+def get_required_literal(regex):
+    """ Find the longest literal string that every match of a regex must
+    contain.
+
+    Checking for this with str.find() is much quicker than running the regex
+    over data that cannot match.
+
+    Parameters
+    ----------
+    regex : compiled regex
+
+    Returns
+    -------
+    literal : str or unicode
+        The same type as the pattern. Empty if there is no such literal, if the
+        regex ignores case, or if it was not compiled by the re module, whose
+        parser this relies on.
+    """
+    if not isinstance(regex, RE_PATTERN_TYPE) or regex.flags & re.IGNORECASE:
+        return ''
+    try:
+        parsed = sre_parse.parse(regex.pattern, regex.flags)
+    except Exception:
+        return ''
+    # Every item at the top level of the pattern must be matched in turn, so
+    # any run of literals there must appear in the match.
+    if isinstance(regex.pattern, unicode):
+        to_char = unichr
+        max_code = sys.maxunicode
+    else:
+        to_char = chr
+        max_code = 255
+    best = regex.pattern[:0]
+    run = []
+    for op, arg in list(parsed) + [(None, None)]:
+        if op == sre_constants.LITERAL and arg <= max_code:
+            run.append(to_char(arg))
+        else:
+            if len(run) > len(best):
+                best = best[:0].join(run)
+            run = []
+    return best
+
 def get_line_offsets(block):
     """ Compute the list of offsets in DataBlock 'block' which correspond to
     the beginnings of new lines.
 
     Returns: (offset list, count of lines in "current block")
+
+    GrepText no longer uses this, since it only locates the lines around each
+    match, but it is kept for code that does.
     """
     # Note: this implementation based on string.find() benchmarks about twice as
     # fast as a list comprehension using re.finditer().
@@ -80,7 +281,31 @@ def get_line_offsets(block):
             # Keep track of the count of lines within the "current block"
             if next_newline >= block.start and next_newline < block.end:
                 line_count += 1
-            
+
+def get_file_size(fp):
+    """ Get the size of the data in a file, if it can be determined.
+
+    Parameters
+    ----------
+    fp : filelike object
+
+    Returns
+    -------
+    size : int or None
+        The size in bytes, or None if the file is not a regular file or the size
+        of its contents cannot be known ahead of time.
+    """
+    if isinstance(fp, gzip.GzipFile):
+        return None  # gzipped data is usually longer than the file
+    try:
+        status = os.fstat(fp.fileno())
+    except AttributeError:  # doesn't support fileno()
+        return None
+    if stat.S_ISREG(status.st_mode):
+        return status.st_size
+    else:
+        return None
+
 def colorize(s, fg=None, bg=None, bold=False, underline=False, reverse=False):
     """ Wraps a string with ANSI color escape sequences corresponding to the
     style parameters given.
@@ -106,23 +331,51 @@ def colorize(s, fg=None, bg=None, bold=False, underline=False, reverse=False):
     -------
     A string with embedded color escape sequences.
     """
-    
+    return (get_style_start(fg, bg, bold, underline, reverse) + s +
+        STYLE_END)
+
+def get_style_start(fg=None, bg=None, bold=False, underline=False,
+    reverse=False):
+    """ Get the ANSI escape sequence that starts a style. The parameters are
+    the same as for colorize().
+    """
     style_fragments = []
-    if fg in COLOR_TABLE:
-        # Foreground colors go from 30-39
-        style_fragments.append(COLOR_TABLE.index(fg) + 30)
-    if bg in COLOR_TABLE:
-        # Background colors go from 40-49
-        style_fragments.append(COLOR_TABLE.index(bg) + 40)
+    if fg in FG_CODES:
+        style_fragments.append(FG_CODES[fg])
+    if bg in BG_CODES:
+        style_fragments.append(BG_CODES[bg])
     if bold:
         style_fragments.append(1)
     if underline:
         style_fragments.append(4)
     if reverse:
         style_fragments.append(7)
-    style_start = '\x1b[' + ';'.join(map(str,style_fragments)) + 'm'
-    style_end = '\x1b[0m'
-    return style_start + s + style_end
+    return '\x1b[' + ';'.join(map(str,style_fragments)) + 'm'
+
+# The escape sequences starting each style in COLOR_STYLE, and a copy of the
+# COLOR_STYLE they were worked out from. Kept by get_style_starts().
+_STYLE_STARTS = {}
+_STYLE_STARTS_FOR = {}
+
+def get_style_starts():
+    """ Get the escape sequences starting each style in COLOR_STYLE.
+
+    They are only worked out again when COLOR_STYLE has changed, so it can
+    still be customized at runtime.
+
+    Returns
+    -------
+    style_starts : dict
+        Maps each style name in COLOR_STYLE to its escape sequence.
+    """
+    global _STYLE_STARTS, _STYLE_STARTS_FOR
+    if COLOR_STYLE != _STYLE_STARTS_FOR:
+        _STYLE_STARTS = dict((name, get_style_start(**style))
+            for name, style in COLOR_STYLE.items())
+        # Copy the styles too, since they may be changed in place.
+        _STYLE_STARTS_FOR = dict((name, dict(style))
+            for name, style in COLOR_STYLE.items())
+    return _STYLE_STARTS
 
 
 class Options(dict):
@@ -152,6 +405,7 @@ def default_options():
         skip_symlink_dirs=True,
         skip_symlink_files=True,
         binary_bytes=4096,
+        engine='re',
     )
     return opt
 
@@ -194,16 +448,21 @@ class GrepText(object):
     """
 
     def __init__(self, regex, options=None):
-        # The compiled regex.
-        self.regex = regex
-        # An equivalent regex with multiline enabled.
-        self.regex_m = re.compile(regex.pattern, regex.flags | re.MULTILINE)
-
         # The options object from parsing the configuration and command line.
         if options is None:
             options = default_options()
         self.options = options
 
+        # The compiled regex.
+        self.regex = regex
+        # An equivalent regex with multiline enabled, compiled by the same
+        # engine.
+        self.regex_m = compile_regex(regex.pattern, regex.flags | re.MULTILINE,
+            getattr(options, 'engine', 're'))
+        # A literal that every match contains, if there is one. Blocks
+        # without it are passed over without running the regex.
+        self.literal = get_required_literal(self.regex_m)
+
     def read_block_with_context(self, prev, fp, fp_size):
         """ Read a block of data from the file, along with some surrounding
         context.
@@ -300,46 +559,61 @@ class GrepText(object):
         -------
         A list of 4-tuples (lineno, type (POST/PRE/MATCH), line, spans).  For
         each tuple of type MATCH, **spans** is a list of (start,end) positions
-        of substrings that matched the pattern.
+        of substrings that matched the pattern, or None if the options turn
+        off use_color.
         """
         context = []
         line_count = 0
-        if isinstance(fp, gzip.GzipFile):
-            fp_size = None  # gzipped data is usually longer than the file
-        else:
-            try:
-                status = os.fstat(fp.fileno())
-                if stat.S_ISREG(status.st_mode):
-                    fp_size = status.st_size
-                else:
-                    fp_size = None
-            except AttributeError:  # doesn't support fileno()
-                fp_size = None
+        fp_size = get_file_size(fp)
 
         block = self.read_block_with_context(None, fp, fp_size)
         while block.end > block.start:
-            (block_line_count, block_context) = self.do_grep_block(block,
-                    line_count - block.before_count)
-            context += block_context
+            self.do_grep_block(block, line_count - block.before_count,
+                context)
             if block.is_last:
                 break
 
             next_block = self.read_block_with_context(block, fp, fp_size)
             if next_block.end > next_block.start:
-                if block_line_count is None:
-                    # If the file contains N blocks, then in the best case we
-                    # will need to compute line offsets for the first N-1 blocks.
-                    # Most files will fit within a single block, so if there are
-                    # no regex matches then we can typically avoid computing *any*
-                    # line offsets.
-                    (_, block_line_count) = get_line_offsets(block)
-                line_count += block_line_count
+                line_count += block.data.count('\n', block.start, block.end)
             block = next_block
 
-        unique_context = self.uniquify_context(context)
-        return unique_context
+        # do_grep_block() keeps the context in order and without duplicates
+        # as it goes, so there is nothing left to sort out.
+        return context
+
+    def has_match(self, fp):
+        """ Determine if a file has any match at all.
 
-    def do_grep_block(self, block, line_num_offset):
+        This stops reading at the first match and does not work out any line
+        numbers or context.
+
+        Parameters
+        ----------
+        fp : filelike object
+            An open filelike object.
+
+        Returns
+        -------
+        has_match : bool
+        """
+        fp_size = get_file_size(fp)
+        block = self.read_block_with_context(None, fp, fp_size)
+        while block.end > block.start:
+            if (self.literal and type(block.data) is type(self.literal) and
+                block.data.find(self.literal, block.start, block.end) < 0):
+                match = None
+            else:
+                match = self.regex_m.search(block.data, block.start, block.end)
+            if match is not None and not (match.start() == block.end and
+                    block.data[block.end - 1] == '\n'):
+                return True
+            if block.is_last:
+                break
+            block = self.read_block_with_context(block, fp, fp_size)
+        return False
+
+    def do_grep_block(self, block, line_num_offset, context=None):
         """ Grep a single block of file content.
 
         Parameters
@@ -350,64 +624,157 @@ class GrepText(object):
         line_num_offset: int
             The number of lines preceding block.data.
 
+        context : list, optional
+            The lines found in the previous blocks of the file. The new lines
+            are appended to it, skipping any that it already holds.
+
         Returns
         -------
-        Tuple of the form
-            (line_count, list of (lineno, type (POST/PRE/MATCH), line, spans).
-        'line_count' is either the number of lines in the block, or None if
-        the line_count was not computed.  For each 4-tuple of type MATCH,
-        **spans** is a list of (start,end) positions of substrings that matched
-        the pattern.
+        A list of (lineno, type (POST/PRE/MATCH), line, spans) in line order
+        without duplicates.  For each 4-tuple of type MATCH, **spans** is a
+        list of (start,end) positions of substrings that matched the pattern,
+        or None if the options turn off use_color.
         """
         before = self.options.before_context
         after = self.options.after_context
-        block_context = []
-        line_offsets = None
-        line_count = None
-        
-        def build_match_context(match):
-            match_line_num = bisect.bisect(line_offsets, match.start() + block.start) - 1
-            before_count = min(before, match_line_num)
-            after_count = min(after, (len(line_offsets) - 1) - match_line_num - 1)
-            match_line = block.data[line_offsets[match_line_num]:line_offsets[match_line_num + 1]]
-            spans = [m.span() for m in self.regex.finditer(match_line)]
-
-            before_ctx = [(i + line_num_offset, PRE,
-                block.data[line_offsets[i]:line_offsets[i+1]], None)
-                    for i in range(match_line_num - before_count, match_line_num)]
-            after_ctx = [(i + line_num_offset, POST,
-                block.data[line_offsets[i]:line_offsets[i+1]], None)
-                    for i in range(match_line_num + 1, match_line_num + after_count + 1)]
-            match_ctx = [(match_line_num + line_num_offset, MATCH, match_line, spans)]
-            return before_ctx + match_ctx + after_ctx
-
-        # Using re.MULTILINE here, so ^ and $ will work as expected.
-        for match in self.regex_m.finditer(block.data[block.start:block.end]):
-            # Computing line offsets is expensive, so we do it lazily.  We don't
-            # take the extra CPU hit unless there's a regex match in the file.
-            if line_offsets is None:
-                (line_offsets, line_count) = get_line_offsets(block)
-            block_context += build_match_context(match)
-
-        return (line_count, block_context)
+        # The spans are only used to color the matches. Options without a
+        # use_color setting at all get them, as before.
+        want_spans = getattr(self.options, 'use_color', True)
+        if context is None:
+            context = []
+        # Bind these once rather than looking them up for every match.
+        append = context.append
+        data = block.data
+        data_len = len(data)
+        count = data.count
+        find = data.find
+        rfind = data.rfind
+        finditer = self.regex.finditer
+
+        def add_match_context(match, search_start, line_start, match_line_num):
+            """ Add the context for a match found by searching from
+            search_start and return the position to resume searching from.
+
+            The match is on the line numbered match_line_num, relative to the
+            start of the data, which begins at line_start.
+            """
+            # Append straight onto context rather than building and
+            # concatenating temporary lists for each match.
+            (match_start, match_end) = match.span()
+            line_end = find('\n', match_start) + 1 or data_len
+            match_num = match_line_num + line_num_offset
+
+            # Matches come in line order, so the only lines that can already
+            # be in the context are the ones at its end, which are contiguous
+            # back to the previous match's context. Lines already shown are
+            # not added again, which keeps the context sorted and unique.
+            last_num = context[-1][0] if context else -1
+            if match_num <= last_num:
+                # This line was shown as 'after' context of an earlier match,
+                # so it has no new 'before' context of its own.
+                n_before = 0
+            else:
+                n_before = min(before, match_num - last_num - 1)
 
-    def uniquify_context(self, context):
-        """ Remove duplicate lines from the list of context lines.
-        """
-        context.sort()
-        unique_context = []
-        for group in itertools.groupby(context, lambda ikl: ikl[0]):
-            for i, kind, line, matches in group[1]:
-                if kind == MATCH:
-                    # Always use a match.
-                    unique_context.append((i, kind, line, matches))
+            # Walk back over the lines of 'before' context.
+            before_starts = []
+            start = line_start
+            for i in xrange(n_before):
+                if start == 0:
                     break
+                start = rfind('\n', 0, start - 1) + 1
+                before_starts.append(start)
+            before_starts.reverse()
+            before_starts.append(line_start)
+            first_num = match_num - len(before_starts) + 1
+            for i in xrange(len(before_starts) - 1):
+                append((first_num + i, PRE,
+                    data[before_starts[i]:before_starts[i+1]], None))
+
+            match_line = data[line_start:line_end]
+            if not want_spans:
+                spans = None
+            elif (search_start <= line_start < match_end <= line_end and
+                match_start < match_end):
+                # The search covered the whole line up to this match, so it is
+                # also the line's first match. Only look for the rest.
+                spans = [(match_start - line_start, match_end - line_start)]
+                spans.extend([m.span() for m in
+                    finditer(match_line, match_end - line_start)])
             else:
-                # No match, only PRE and/or POST lines. Use the last one, which
-                # should be a POST since we've sorted it that way.
-                unique_context.append((i, kind, line, matches))
+                spans = [m.span() for m in finditer(match_line)]
+            if match_num <= last_num:
+                # A match wins over the 'after' context line already there.
+                context[match_num - last_num - 1] = (match_num, MATCH,
+                    match_line, spans)
+            else:
+                append((match_num, MATCH, match_line, spans))
+
+            # Walk forward over the lines of 'after' context, passing over the
+            # ones that are already there.
+            start = line_end
+            for i in xrange(1, after + 1):
+                if start >= data_len:
+                    break
+                next_start = find('\n', start) + 1 or data_len
+                if match_num + i > last_num:
+                    append((match_num + i, POST, data[start:next_start], None))
+                start = next_start
+            # Any further matches on this line would only be duplicates.
+            return max(line_end, match_end)
+
+        # Using re.MULTILINE here, so ^ and $ will work as expected. Passing
+        # the bounds of the current block as pos and endpos avoids copying it
+        # out of the data with its context. block.start and every position we
+        # resume from are at the beginning of a line, so ^ still matches there.
+        search = self.regex_m.search
+        pos = block.start
+        end = block.end
+        literal = self.literal
+        # Mixing str and unicode would decode one of them, which can fail.
+        if (literal and type(data) is type(literal) and
+            find(literal, pos, end) < 0):
+            # Nothing in this block can match.
+            return context
+        # Only the lines around each match are located, with str.find() and
+        # friends, rather than indexing every line in the block. The line
+        # numbers come from counting the newlines skipped since the previous
+        # match, which is done in C.
+        line_start = 0
+        line_num = 0
+        while pos < end:
+            match = search(data, pos, end)
+            if match is None:
+                break
+            if match.start() == end and data[end - 1] == '\n':
+                # An empty match after the block's final newline belongs to the
+                # next block, if there is one.
+                break
+            next_line_start = rfind('\n', 0, match.start()) + 1
+            line_num += count('\n', line_start, next_line_start)
+            line_start = next_line_start
+            pos = add_match_context(match, pos, line_start, line_num)
 
-        return unique_context
+        return context
+
+    def uniquify_context(self, context):
+        """ Remove duplicate lines from the list of context lines.
+
+        do_grep() already returns its lines in order without duplicates, so it
+        no longer needs this, but it is kept for code that combines context
+        lines itself.
+        """
+        # Keep one entry per line number in a single pass. A match always
+        # wins, and otherwise a POST line is preferred over a PRE line.
+        best = {}
+        get = best.get
+        for entry in context:
+            i = entry[0]
+            current = get(i)
+            if current is None or (current[1] != MATCH and
+                    (entry[1] == MATCH or entry[1] > current[1])):
+                best[i] = entry
+        return [best[i] for i in sorted(best)]
 
     def report(self, context_lines, filename=None):
         """ Return a string showing the results.
@@ -434,10 +801,13 @@ class GrepText(object):
             line = '%s\n' % filename
             lines.append(line)
         else:
+            if self.options.use_color:
+                style_starts = get_style_starts()
             if self.options.show_filename and filename is not None and not self.options.show_emacs:
                 line = '%s:\n' % filename
                 if self.options.use_color:
-                    line = colorize(line, **COLOR_STYLE.get('filename', {}))
+                    line = (style_starts.get('filename', get_style_start()) +
+                        line + STYLE_END)
                 lines.append(line)
             if self.options.show_emacs:
                 template = '%(filename)s:%(lineno)s: %(line)s'
@@ -445,25 +815,27 @@ class GrepText(object):
                 template = '%(lineno)5s %(sep)s %(line)s'
             else:
                 template = '%(line)s'
+            # Decide on highlighting once rather than for every line.
+            color_matches = self.options.use_color and 'searchterm' in style_starts
+            # Reuse one namespace for filling in the template.
+            ns = dict(filename=filename)
             for i, kind, line, spans in context_lines:
-                if self.options.use_color and kind == MATCH and 'searchterm' in COLOR_STYLE:
-                    style = COLOR_STYLE['searchterm']
-                    orig_line = line[:]
-                    total_offset = 0
+                if color_matches and kind == MATCH:
+                    # Build the highlighted line in one pass rather than
+                    # splicing each span into it.
+                    style_start = style_starts['searchterm']
+                    parts = []
+                    prev = 0
                     for start, end in spans:
-                        old_substring = orig_line[start:end]
-                        start += total_offset
-                        end += total_offset
-                        color_substring = colorize(old_substring, **style)
-                        line = line[:start] + color_substring + line[end:]
-                        total_offset += len(color_substring) - len(old_substring)
-                        
-                ns = dict(
-                    lineno = i+1,
-                    sep = {PRE: '-', POST: '+', MATCH: ':'}[kind],
-                    line = line,
-                    filename = filename,
-                )
+                        parts.extend((line[prev:start], style_start,
+                            line[start:end], STYLE_END))
+                        prev = end
+                    parts.append(line[prev:])
+                    line = ''.join(parts)
+
+                ns['lineno'] = i+1
+                ns['sep'] = SEP_SYMBOLS[kind]
+                ns['line'] = line
                 line = template % ns
                 lines.append(line)
                 if not line.endswith('\n'):
@@ -498,11 +870,21 @@ class GrepText(object):
             # 'r' does the right thing for both open ('rt') and gzip.open ('rb')
             f = opener(filename, 'r')
         try:
-            unique_context = self.do_grep(f)
+            if self.options.show_match:
+                unique_context = self.do_grep(f)
+            else:
+                # Only the filename gets reported, so we can stop at the first
+                # match.
+                found = self.has_match(f)
         finally:
             if filename != '-':
                 f.close()
-        report = self.report(unique_context, filename)
+        if self.options.show_match:
+            report = self.report(unique_context, filename)
+        elif found:
+            report = '%s\n' % filename
+        else:
+            report = ''
         return report
 
 
@@ -531,12 +913,19 @@ class FileRecognizer(object):
     binary_bytes : int
         The number of bytes to check at the beginning and end of a file for
         binary characters.
+    text_exts : container of str
+        A list of file extensions that are known to be text. Files with these
+        extensions are not read to check for binary characters.
+    binary_exts : container of str
+        A list of file extensions that are known to be binary. Files with these
+        extensions are not read to check for binary characters.
     """
 
     def __init__(self, skip_hidden_dirs=False, skip_hidden_files=False,
                  skip_backup_files=False, skip_dirs=set(), skip_exts=set(),
                  skip_symlink_dirs=True, skip_symlink_files=True,
-                 binary_bytes=4096):
+                 binary_bytes=4096, text_exts=frozenset(),
+                 binary_exts=frozenset()):
         self.skip_hidden_dirs = skip_hidden_dirs
         self.skip_hidden_files = skip_hidden_files
         self.skip_backup_files = skip_backup_files
@@ -546,17 +935,23 @@ class FileRecognizer(object):
         # compatible with os.path.splitext and hence can all be
         # checked for in a single set-lookup, and the weirdos that
         # can't and therefore must be checked for one at a time.
-        self.skip_exts_simple = set()
-        self.skip_exts_endswith = list()
+        # The weirdos are kept as a tuple so that a single str.endswith() call
+        # can check them all.
+        skip_exts_simple = set()
+        skip_exts_endswith = list()
         for ext in skip_exts:
             if os.path.splitext('foo.bar'+ext)[1] == ext:
-                self.skip_exts_simple.add(ext)
+                skip_exts_simple.add(ext)
             else:
-                self.skip_exts_endswith.append(ext)
-        
+                skip_exts_endswith.append(ext)
+        self.skip_exts_simple = frozenset(skip_exts_simple)
+        self.skip_exts_endswith = tuple(skip_exts_endswith)
+
         self.skip_symlink_dirs = skip_symlink_dirs
         self.skip_symlink_files = skip_symlink_files
         self.binary_bytes = binary_bytes
+        self.text_exts = text_exts
+        self.binary_exts = binary_exts
 
     def is_binary(self, filename):
         """ Determine if a given file is binary or not.
@@ -609,19 +1004,22 @@ class FileRecognizer(object):
         """
         is_gzipped_text = False
         f = open(filename, 'rb')
-        marker = f.read(2)
-        f.close()
-        if marker == GZIP_MAGIC:
-            fp = gzip.open(filename)
-            try:
+        try:
+            if f.read(2) == GZIP_MAGIC:
+                # Decompress from the file we already have open.
+                f.seek(0)
+                fp = gzip.GzipFile(fileobj=f)
                 try:
-                    is_gzipped_text = not self._is_binary_file(fp)
-                except IOError:
-                    # We saw the GZIP_MAGIC marker, but it is not actually a gzip
-                    # file.
-                    is_gzipped_text = False
-            finally:
-                fp.close()
+                    try:
+                        is_gzipped_text = not self._is_binary_file(fp)
+                    except IOError:
+                        # We saw the GZIP_MAGIC marker, but it is not actually a
+                        # gzip file.
+                        is_gzipped_text = False
+                finally:
+                    fp.close()
+        finally:
+            f.close()
         return is_gzipped_text
 
     def recognize(self, filename):
@@ -661,11 +1059,16 @@ class FileRecognizer(object):
         kind : str
         """
         try:
-            st_mode = os.stat(filename).st_mode
+            # lstat() tells us whether this is a symlink, so only symlinks
+            # need a second stat() of their target.
+            st_mode = os.lstat(filename).st_mode
+            is_link = stat.S_ISLNK(st_mode)
+            if is_link:
+                st_mode = os.stat(filename).st_mode
             if stat.S_ISREG(st_mode):
-                return self.recognize_file(filename)
+                return self.recognize_file(filename, is_link=is_link)
             elif stat.S_ISDIR(st_mode):
-                return self.recognize_directory(filename)
+                return self.recognize_directory(filename, is_link=is_link)
             else:
                 # We're only interested in regular files and directories.
                 # A named pipe in particular would be problematic, because
@@ -674,49 +1077,100 @@ class FileRecognizer(object):
         except OSError:
             return 'unreadable'
         
-    def recognize_directory(self, filename):
+    def recognize_directory(self, filename, is_link=None):
         """ Determine what to do with a directory.
+
+        If it is already known whether the directory is a symlink, pass it as
+        is_link to avoid checking again.
         """
-        basename = os.path.split(filename)[-1]
-        if (self.skip_hidden_dirs and basename.startswith('.') and 
-            basename not in ('.', '..')):
+        basename = path_basename(filename)
+        if (self.skip_hidden_dirs and basename.startswith('.') and
+            basename != '.' and basename != '..'):
             return 'skip'
-        if self.skip_symlink_dirs and os.path.islink(filename):
-            return 'link'
+        # Check the names before making any system calls.
         if basename in self.skip_dirs:
             return 'skip'
+        if self.skip_symlink_dirs:
+            if is_link is None:
+                is_link = os.path.islink(filename)
+            if is_link:
+                return 'link'
         return 'directory'
 
-    def recognize_file(self, filename):
+    def recognize_file(self, filename, is_link=None):
         """ Determine what to do with a file.
+
+        If it is already known whether the file is a symlink, pass it as
+        is_link to avoid checking again.
         """
-        basename = os.path.split(filename)[-1]
+        basename = path_basename(filename)
         if self.skip_hidden_files and basename.startswith('.'):
             return 'skip'
         if self.skip_backup_files and basename.endswith('~'):
             return 'skip'
-        if self.skip_symlink_files and os.path.islink(filename):
-            return 'link'
-        
+        # Check the names before making any system calls.
         filename_nc = os.path.normcase(filename)
-        ext = os.path.splitext(filename_nc)[1]
+        ext = basename_ext(path_basename(filename_nc))
         if ext in self.skip_exts_simple or ext.startswith('.~'):
             return 'skip'
-        for ext in self.skip_exts_endswith:
-            if filename_nc.endswith(ext):
-                return 'skip'
-        try:
-            if self.is_binary(filename):
-                if self.is_gzipped_text(filename):
-                    return 'gzip'
-                else:
-                    return 'binary'
-            else:
+        if filename_nc.endswith(self.skip_exts_endswith):
+            return 'skip'
+        if self.skip_symlink_files:
+            if is_link is None:
+                is_link = os.path.islink(filename)
+            if is_link:
+                return 'link'
+
+        if ext in self.text_exts or ext in self.binary_exts:
+            # Skip reading the file, but we still need to know that it can be
+            # read.
+            if not os.access(filename, os.R_OK):
+                return 'unreadable'
+            if ext in self.text_exts:
                 return 'text'
+            return 'binary'
+        try:
+            return self._recognize_contents(filename)
         except (OSError, IOError):
             return 'unreadable'
 
-    def walk(self, startpath):
+    def _recognize_contents(self, filename):
+        """ Determine whether a file is 'text', 'gzip' or 'binary' from its
+        contents.
+
+        This is the same as checking is_binary() and then is_gzipped_text(),
+        but only opens the file once.
+        """
+        f = open(filename, 'rb')
+        try:
+            try:
+                head = f.read(self.binary_bytes)
+            except Exception, e:
+                # Like _is_binary_file(), assume the file is binary if it
+                # cannot be read.
+                return 'binary'
+            if not is_binary_string(head):
+                return 'text'
+            # The same read tells us whether it might be gzipped.
+            if head[:2] != GZIP_MAGIC:
+                return 'binary'
+            f.seek(0)
+            fp = gzip.GzipFile(fileobj=f)
+            try:
+                try:
+                    if self._is_binary_file(fp):
+                        return 'binary'
+                except IOError:
+                    # We saw the GZIP_MAGIC marker, but it is not actually a
+                    # gzip file.
+                    return 'binary'
+            finally:
+                fp.close()
+            return 'gzip'
+        finally:
+            f.close()
+
+    def walk(self, startpath, include_match=None):
         """ Walk the tree from a given start path yielding all of the files (not
         directories) and their kinds underneath it depth first.
 
@@ -726,6 +1180,10 @@ class FileRecognizer(object):
         Parameters
         ----------
         startpath : str
+        include_match : callable, optional
+            Tests the basenames of files, e.g. a function from
+            get_glob_matcher(). Files that fail it are passed over without
+            reading them to recognize their kind.
 
         Yields
         ------
@@ -733,19 +1191,90 @@ class FileRecognizer(object):
         kind : str
         """
         kind = self.recognize(startpath)
-        if kind in ('binary', 'text', 'gzip'):
-            yield startpath, kind
-            # Not a directory, so there is no need to recurse.
+        if (kind != 'directory' and include_match is not None and
+            not include_match(path_basename(startpath))):
             return
-        elif kind == 'directory':
+        # Use an explicit stack of paths still to visit rather than recursing
+        # so that deep trees do not pay for a chain of nested generators.
+        stack = [(startpath, kind, None)]
+        while stack:
+            path, kind, is_link = stack.pop()
+            if kind is None:
+                kind = self.recognize(path)
+            elif kind == 'file':
+                # Files are only opened to recognize their contents when their
+                # turn comes, so the first ones are yielded without waiting on
+                # the rest of the directory.
+                kind = self.recognize_file(path, is_link=is_link)
+            if kind in ('binary', 'text', 'gzip'):
+                yield path, kind
+            elif kind == 'directory':
+                try:
+                    entries = self.list_entries(path, include_match)
+                except OSError:
+                    continue
+                # Push in reverse so that the entries are visited in sorted
+                # order.
+                entries.reverse()
+                stack.extend(entries)
+
+    def list_entries(self, dirname, include_match=None):
+        """ List a directory, recognizing what can be told from the listing
+        alone.
+
+        When os.scandir() or its backport is available, the file types it gets
+        from the directory listing spare a stat() of each entry that is not a
+        symlink. No file is opened.
+
+        Parameters
+        ----------
+        dirname : str
+        include_match : callable, optional
+            Tests the basenames of files. Files that fail it are recognized as
+            'skip'.
+
+        Returns
+        -------
+        entries : list of (filename, kind, is_link)
+            Sorted by basename. kind is 'file' for a regular file whose
+            contents still need recognize_file(), or None if nothing is known
+            yet and it needs recognize(). is_link is None if it is not known.
+        """
+        entries = []
+        # The names in a directory listing are never absolute, so joining each
+        # of them to dirname is just adding them to this prefix.
+        prefix = os.path.join(dirname, '')
+        if scandir is None:
+            for basename in sorted(os.listdir(dirname)):
+                filename = prefix + basename
+                if (include_match is None or include_match(basename) or
+                    os.path.isdir(filename)):
+                    kind = None
+                else:
+                    kind = 'skip'
+                entries.append((filename, kind, None))
+            return entries
+        for entry in scandir(dirname):
+            filename = prefix + entry.name
+            is_link = None
             try:
-                basenames = os.listdir(startpath)
+                # These follow symlinks, like recognize() does.
+                is_link = entry.is_symlink()
+                if entry.is_file():
+                    if include_match is None or include_match(entry.name):
+                        kind = 'file'
+                    else:
+                        kind = 'skip'
+                elif entry.is_dir():
+                    kind = self.recognize_directory(filename, is_link=is_link)
+                else:
+                    kind = 'skip'
             except OSError:
-                return
-            for basename in sorted(basenames):
-                path = os.path.join(startpath, basename)
-                for fn, k in self.walk(path):
-                    yield fn, k
+                kind = 'unreadable'
+            entries.append((filename, kind, is_link))
+        # All of the filenames start with dirname, so this sorts by basename.
+        entries.sort()
+        return entries
 
 
 def get_grin_arg_parser(parser=None):
@@ -762,6 +1291,10 @@ def get_grin_arg_parser(parser=None):
         help="show program's version number and exit")
     parser.add_argument('-i', '--ignore-case', action='append_const',
         dest='re_flags', const=re.I, default=[], help="ignore case in the regex")
+    parser.add_argument('--engine', choices=REGEX_ENGINES, default='re',
+        help="the regex engine to use; engines other than re must be "
+            "installed separately, and patterns that re2 cannot handle fall "
+            "back to re [default=%(default)r]")
     parser.add_argument('-A', '--after-context', default=0, type=int,
         help="the number of lines of context to show after the match [default=%(default)r]")
     parser.add_argument('-B', '--before-context', default=0, type=int,
@@ -844,6 +1377,17 @@ def get_grin_arg_parser(parser=None):
 
     return parser
 
+def add_jobs_argument(parser):
+    """ Add the -j/--jobs option to a command-line parser.
+
+    This is separate from get_grin_arg_parser() since only programs that grep
+    with grin_main()'s worker processes can honor it.
+    """
+    parser.add_argument('-j', '--jobs', default=1, type=int,
+        help="the number of processes to grep files with; 0 uses one per CPU "
+            "[default=%(default)r]")
+    return parser
+
 def get_grind_arg_parser(parser=None):
     """ Create the command-line parser for the find-like companion program.
     """
@@ -907,8 +1451,8 @@ def get_recognizer(args):
     """ Get the file recognizer object from the configured options.
     """
     # Make sure we have empty sets when we have empty strings.
-    skip_dirs = set([x for x in args.skip_dirs.split(',') if x])
-    skip_exts = set([x for x in args.skip_exts.split(',') if x])
+    skip_dirs = frozenset([x for x in args.skip_dirs.split(',') if x])
+    skip_exts = frozenset([x for x in args.skip_exts.split(',') if x])
     fr = FileRecognizer(
         skip_hidden_files=args.skip_hidden_files,
         skip_backup_files=args.skip_backup_files,
@@ -917,9 +1461,42 @@ def get_recognizer(args):
         skip_exts=skip_exts,
         skip_symlink_files=not args.follow_symlinks,
         skip_symlink_dirs=not args.follow_symlinks,
+        text_exts=KNOWN_TEXT_EXTS,
+        binary_exts=KNOWN_BINARY_EXTS,
     )
     return fr
 
+def iter_files_from_file(files_file, null_separated=False):
+    """ Generate the filenames listed in a file, one per line or separated by
+    NULs.
+
+    Parameters
+    ----------
+    files_file : filelike object
+    null_separated : bool
+        Whether the filenames are separated by NULs instead of newlines.
+
+    Yields
+    ------
+    filename : str
+        The filename with surrounding whitespace removed. It may be empty.
+    """
+    if null_separated:
+        # Read in blocks, carrying any partial filename over to the next one.
+        partial = ''
+        while True:
+            block = files_file.read(FILES_BLOCKSIZE)
+            if not block:
+                break
+            names = (partial + block).split('\0')
+            partial = names.pop()
+            for name in names:
+                yield name.strip()
+        yield partial.strip()
+    else:
+        for line in files_file:
+            yield line.strip()
+
 def get_filenames(args):
     """ Generate the filenames to grep.
 
@@ -938,67 +1515,113 @@ def get_filenames(args):
     ------
     IOError if a requested file cannot be found.
     """
-    files = []
     # If the user has given us a file with filenames, consume them first.
+    # They are read lazily, so grepping can start before the whole list is
+    # read.
+    sources = []
+    should_close = False
     if args.files_from_file is not None:
         if args.files_from_file == '-':
             files_file = sys.stdin
-            should_close = False
         elif os.path.exists(args.files_from_file):
             files_file = open(args.files_from_file)
             should_close = True
         else:
             raise IOError(2, 'No such file: %r' % args.files_from_file)
-
-        try:
-            # Remove ''
-            # XXX: how can I detect bad filenames? One user accidentally ran
-            # grin -f against a binary file and got an unhelpful error message
-            # later.
-            if args.null_separated:
-                files.extend([x.strip() for x in files_file.read().split('\0')])
-            else:
-                files.extend([x.strip() for x in files_file])
-        finally:
-            if should_close:
-                files_file.close()
+        # XXX: how can I detect bad filenames? One user accidentally ran
+        # grin -f against a binary file and got an unhelpful error message
+        # later.
+        sources.append(iter_files_from_file(files_file, args.null_separated))
 
     # Now add the filenames provided on the command line itself.
-    files.extend(args.files)
+    sources.append(args.files)
     if args.sys_path:
-        files.extend(sys.path)
-    # Make sure we don't have any empty strings lying around.
-    # Also skip certain special null files which may be added by programs like
-    # Emacs.
-    if sys.platform == 'win32':
-        upper_bad = set(['NUL:', 'NUL'])
-        raw_bad = set([''])
-    else:
-        upper_bad = set()
-        raw_bad = set(['', '/dev/null'])
-    files = [fn for fn in files if fn not in raw_bad and fn.upper() not in upper_bad]
-    if len(files) == 0:
-        # Add the current directory at least.
-        files = ['.']
-
-    # Go over our list of filenames and see if we can recognize each as
-    # something we want to grep.
+        sources.append(sys.path)
+    # Go over our filenames and see if we can recognize each as something we
+    # want to grep.
     fr = get_recognizer(args)
-    for fn in files:
-        # Special case text stdin.
-        if fn == '-':
-            yield fn, 'text'
-            continue
-        kind = fr.recognize(fn)
-        if kind in ('text', 'gzip') and fnmatch.fnmatch(os.path.basename(fn), args.include):
-            yield fn, kind
-        elif kind == 'directory':
-            for filename, k in fr.walk(fn):
-                if k in ('text', 'gzip') and fnmatch.fnmatch(os.path.basename(filename), args.include):
-                    yield filename, k
+    include_match = get_glob_matcher(args.include)
+    # Bind the names used for every filename once.
+    get_filenames_for = _get_filenames_for
+    is_null_filename = is_empty_or_null_filename
+    try:
+        any_files = False
+        for fn in itertools.chain(*sources):
+            # Make sure we don't have any empty strings lying around.
+            # Also skip certain special null files which may be added by
+            # programs like Emacs.
+            if is_null_filename(fn):
+                continue
+            any_files = True
+            for filename, kind in get_filenames_for(fr, fn, include_match):
+                yield filename, kind
+        if not any_files:
+            # Add the current directory at least.
+            for filename, kind in _get_filenames_for(fr, '.', include_match):
+                yield filename, kind
+    finally:
+        if should_close:
+            files_file.close()
+
+def _get_filenames_for(fr, fn, include_match):
+    """ Generate the files to grep for a single filename given by the user.
+
+    include_match is a function from get_glob_matcher() that tests the
+    basenames of the files, or None to include them all.
+    """
+    # Special case text stdin.
+    if fn == '-':
+        yield fn, 'text'
+        return
+    kind = fr.recognize(fn)
+    if kind in GREP_KINDS and (include_match is None or
+        include_match(path_basename(fn))):
+        yield fn, kind
+    elif kind == 'directory':
+        # walk() is a generator, so the files are passed on as soon as they are
+        # found. It also checks them against --include before reading them.
+        grep_kinds = GREP_KINDS
+        for filename, k in fr.walk(fn, include_match):
+            if k in grep_kinds:
+                yield filename, k
         # XXX: warn about other files?
         # XXX: handle binary?
 
+def get_glob_matcher(pattern):
+    """ Get a function that tests basenames against a glob pattern.
+
+    This is equivalent to fnmatch.fnmatch(basename, pattern), but the pattern is
+    only translated and compiled once, and the common "*.ext" patterns are
+    checked with str.endswith() instead of a regex.
+
+    Parameters
+    ----------
+    pattern : str
+
+    Returns
+    -------
+    match : callable or None
+        Takes a basename and returns a true value if it matches. None if the
+        pattern matches every basename, like the default "*".
+    """
+    if pattern.strip('*') == '' and pattern != '':
+        # There is nothing to test.
+        return None
+    pattern = os.path.normcase(pattern)
+    suffix = pattern[1:]
+    if pattern.startswith('*.') and not [c for c in suffix if c in '*?[']:
+        def match(name):
+            return name.endswith(suffix)
+    else:
+        match = re.compile(fnmatch.translate(pattern)).match
+    if os.path.normcase('A') == 'A':
+        return match
+    else:
+        # Like fnmatch, compare case-insensitively on platforms that do.
+        def match_nc(name):
+            return match(os.path.normcase(name))
+        return match_nc
+
 def get_regex(args):
     """ Get the compiled regex object to search with.
     """
@@ -1006,16 +1629,148 @@ def get_regex(args):
     flags = 0
     for flag in args.re_flags:
         flags |= flag
-    return re.compile(args.regex, flags)
+    return compile_regex(args.regex, flags, getattr(args, 'engine', 're'))
+
 
+def write_reports(reports, out=None):
+    """ Write out reports, batching them up into fewer, larger writes unless
+    someone is watching the results come in.
+
+    If getting the reports fails partway through, the ones that are already
+    finished are written out before the error is passed on.
+
+    Parameters
+    ----------
+    reports : iterable of str
+    out : file, optional
+        Where to write the reports. sys.stdout by default.
+    """
+    if out is None:
+        out = sys.stdout
+    if out.isatty():
+        # Pass each report through as soon as it is available.
+        blocksize = 0
+    else:
+        blocksize = WRITE_BLOCKSIZE
+    write = out.write
+    pending = []
+    size = 0
+    try:
+        for report in reports:
+            if not report:
+                continue
+            pending.append(report)
+            size += len(report)
+            if size >= blocksize:
+                text = ''.join(pending)
+                pending = []
+                size = 0
+                write(text)
+    except:
+        # Keep the original error, even if writing out what we have fails too.
+        exc_info = sys.exc_info()
+        if pending:
+            try:
+                write(''.join(pending))
+            except Exception:
+                pass
+        raise exc_info[0], exc_info[1], exc_info[2]
+    if pending:
+        write(''.join(pending))
+
+# The GrepText used by each --jobs worker process.
+_worker_grep = None
+
+def _init_grep_worker(pattern, flags, options):
+    """ Set up a --jobs worker process.
+
+    The regex is recompiled in the worker since not every engine's compiled
+    patterns can be pickled.
+    """
+    global _worker_grep
+    # Leave Ctrl-C to the parent process, which terminates the pool.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _worker_grep = GrepText(
+        compile_regex(pattern, flags, getattr(options, 'engine', 're')), options)
+
+def _grep_worker(filename_kind):
+    """ Grep a single file in a --jobs worker process.
+
+    Returns None for stdin, which the worker does not share with the parent
+    process; the parent must grep it itself.
+    """
+    filename, kind = filename_kind
+    if filename == '-':
+        return None
+    return _worker_grep.grep_a_file(filename, opener=OPENERS[kind])
+
+def _imap_from_parent(pool, func, iterable, chunksize, ahead):
+    """ Like pool.imap(func, iterable, chunksize), but iterate over iterable in
+    this process.
+
+    pool.imap() iterates in one of the pool's threads, where an exception from
+    the iterable is lost and the remaining items are silently dropped. Here it
+    is raised to the caller after the results of the items before it.
+
+    Parameters
+    ----------
+    pool : multiprocessing.Pool
+    func : callable
+    iterable : iterable
+    chunksize : int
+        The number of items to hand to a worker at a time.
+    ahead : int
+        The number of chunks to keep queued for the workers.
+
+    Yields
+    ------
+    The results of func for each item, in order.
+    """
+    iterator = iter(iterable)
+    pending = collections.deque()
+    exc_info = None
+    done = False
+    while True:
+        while not done and len(pending) < ahead:
+            chunk = []
+            try:
+                for item in iterator:
+                    chunk.append(item)
+                    if len(chunk) >= chunksize:
+                        break
+                else:
+                    done = True
+            except Exception:
+                exc_info = sys.exc_info()
+                done = True
+            if chunk:
+                pending.append(pool.map_async(func, chunk))
+        if not pending:
+            break
+        async_result = pending.popleft()
+        while not async_result.ready():
+            async_result.wait(JOBS_WAIT_TIMEOUT)
+        for result in async_result.get():
+            yield result
+    if exc_info is not None:
+        raise exc_info[0], exc_info[1], exc_info[2]
+
+def get_env_args(name):
+    """ Split the arguments given in an environment variable like a shell would.
+    """
+    value = os.getenv(name)
+    if not value:
+        # Most of the time the variable is not set, so skip shlex entirely.
+        return []
+    return shlex.split(value)
 
 def grin_main(argv=None):
     try:
         if argv is None:
             # Look at the GRIN_ARGS environment variable for more arguments.
-            env_args = shlex.split(os.getenv('GRIN_ARGS', ''))
+            env_args = get_env_args('GRIN_ARGS')
             argv = [sys.argv[0]] + env_args + sys.argv[1:]
-        parser = get_grin_arg_parser()
+        parser = add_jobs_argument(get_grin_arg_parser())
         args = parser.parse_args(argv[1:])
         if args.context is not None:
             args.before_context = args.context
@@ -1024,12 +1779,35 @@ def grin_main(argv=None):
             sys.stdout.isatty() and
             (os.environ.get('TERM') != 'dumb'))
 
-        regex = get_regex(args)
+        try:
+            regex = get_regex(args)
+        except ImportError, e:
+            parser.error(str(e))
         g = GrepText(regex, args)
-        openers = dict(text=open, gzip=gzip.open)
-        for filename, kind in get_filenames(args):
-            report = g.grep_a_file(filename, opener=openers[kind])
-            sys.stdout.write(report)
+        if args.jobs <= 0:
+            try:
+                args.jobs = multiprocessing.cpu_count()
+            except NotImplementedError:
+                args.jobs = 1
+        if args.jobs > 1:
+            pool = multiprocessing.Pool(args.jobs, _init_grep_worker,
+                (regex.pattern, regex.flags, args))
+            # The reports come back in the same order as the files. The files
+            # are found in this process so that errors finding them are raised
+            # here, as they are without --jobs.
+            reports = (report if report is not None else g.grep_a_file('-')
+                for report in _imap_from_parent(pool, _grep_worker,
+                    get_filenames(args), JOBS_CHUNKSIZE, 2 * args.jobs))
+        else:
+            pool = None
+            reports = (g.grep_a_file(filename, opener=OPENERS[kind])
+                for filename, kind in get_filenames(args))
+        try:
+            write_reports(reports)
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
     except KeyboardInterrupt:
         raise SystemExit(0)
     except IOError, e:
@@ -1039,38 +1817,31 @@ def grin_main(argv=None):
             raise SystemExit(0)
         raise
 
-def print_line(filename):
-    print filename
-
-def print_null(filename):
-    # Note that the final filename will have a trailing NUL, just like 
-    # "find -print0" does.
-    sys.stdout.write(filename)
-    sys.stdout.write('\0')
-
 def grind_main(argv=None):
     try:
         if argv is None:
             # Look at the GRIND_ARGS environment variable for more arguments.
-            env_args = shlex.split(os.getenv('GRIND_ARGS', ''))
+            env_args = get_env_args('GRIND_ARGS')
             argv = [sys.argv[0]] + env_args + sys.argv[1:]
         parser = get_grind_arg_parser()
         args = parser.parse_args(argv[1:])
 
-        # Define the output function.
+        # Define the output separator. Note that the final filename will have
+        # a trailing separator, just like "find -print0" does.
         if args.null_separated:
-            output = print_null
+            sep = '\0'
         else:
-            output = print_line
+            sep = '\n'
 
         if args.sys_path:
             args.dirs.extend(sys.path)
 
         fr = get_recognizer(args)
-        for dir in args.dirs:
-            for filename, k in fr.walk(dir):
-                if fnmatch.fnmatch(os.path.basename(filename), args.glob):
-                    output(filename)
+        glob_match = get_glob_matcher(args.glob)
+        # The walk only recognizes the files matching the glob.
+        lines = (filename + sep for dir in args.dirs
+            for filename, k in fr.walk(dir, glob_match))
+        write_reports(lines)
     except KeyboardInterrupt:
         raise SystemExit(0)
     except IOError, e:
@@ -0,0 +1,208 @@
+""" Test the helpers behind the command-line programs.
+"""
+
+from cStringIO import StringIO
+import fnmatch
+import os
+import re
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+import grin
+
+# A scratch directory of files to grep, made by setup().
+tmpdir = None
+
+def setup():
+    global tmpdir
+    tmpdir = tempfile.mkdtemp()
+    for i in range(10):
+        f = open(os.path.join(tmpdir, 'file%d.txt' % i), 'wb')
+        f.write('foo %d\nbar\n' % i * (i + 1))
+        f.close()
+
+def teardown():
+    shutil.rmtree(tmpdir)
+
+def run_grin(argv):
+    """ Run grin_main() and return what it writes to stdout.
+    """
+    old_stdout = sys.stdout
+    sys.stdout = StringIO()
+    try:
+        grin.grin_main(['grin', '--no-color'] + argv)
+        return sys.stdout.getvalue()
+    finally:
+        sys.stdout = old_stdout
+
+def test_write_reports():
+    out = StringIO()
+    grin.write_reports(['a.txt:\n', '', 'b.txt:\n'], out)
+    assert out.getvalue() == 'a.txt:\nb.txt:\n'
+
+def test_write_reports_error():
+    # The reports finished before an error are still written out.
+    def reports():
+        yield 'a.txt:\n'
+        raise IOError('No such file')
+    out = StringIO()
+    try:
+        grin.write_reports(reports(), out)
+    except IOError as e:
+        assert str(e) == 'No such file'
+    else:
+        raise AssertionError('the IOError was not passed on')
+    assert out.getvalue() == 'a.txt:\n'
+
+def test_jobs():
+    serial = run_grin(['foo', tmpdir])
+    assert serial.count(' : foo ') == 55
+    assert run_grin(['-j', '3', 'foo', tmpdir]) == serial
+    assert run_grin(['-j', '0', 'foo', tmpdir]) == serial
+
+def test_jobs_missing_files_from_file():
+    # The error is not lost in the worker pool.
+    missing = os.path.join(tmpdir, 'missing')
+    for jobs in ['1', '2']:
+        try:
+            run_grin(['-j', jobs, '-f', missing, 'foo'])
+        except IOError as e:
+            assert missing in str(e)
+        else:
+            raise AssertionError('the IOError was not raised with -j %s' % jobs)
+
+def test_jobs_only_for_grin():
+    # Programs built on the shared parser do not take -j, which they would not
+    # honor.
+    parser = grin.get_grin_arg_parser()
+    assert '-j' not in parser._option_string_actions
+    parser = grin.add_jobs_argument(grin.get_grin_arg_parser())
+    assert parser.parse_args(['-j', '4', 'foo']).jobs == 4
+
+def test_jobs_interrupted():
+    # Ctrl-C stops the workers and the parent instead of leaving the parent
+    # waiting forever on results that will not come.
+    slow_dir = os.path.join(tmpdir, 'slow')
+    os.mkdir(slow_dir)
+    for i in range(4):
+        f = open(os.path.join(slow_dir, 'slow%d.txt' % i), 'wb')
+        f.write(('x' * 22 + 'zy\n') * 40)
+        f.close()
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.path.dirname(os.path.abspath(grin.__file__))
+    # Start a new process group so that the interrupt reaches the workers as
+    # it would from a terminal.
+    p = subprocess.Popen([sys.executable, '-c', 'import grin; grin.grin_main()',
+        '-j', '2', '-f', '-', '(x+x+)+y'], stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE, env=env, preexec_fn=os.setsid)
+    p.stdin.write(''.join(os.path.join(slow_dir, 'slow%d.txt\n' % i)
+        for i in range(4)))
+    p.stdin.close()
+    time.sleep(1.0)
+    os.killpg(p.pid, signal.SIGINT)
+    deadline = time.time() + 10.0
+    while p.poll() is None and time.time() < deadline:
+        time.sleep(0.1)
+    if p.poll() is None:
+        os.killpg(p.pid, signal.SIGKILL)
+        p.wait()
+        raise AssertionError('grin -j 2 did not exit after SIGINT')
+    assert p.returncode == 0
+
+def test_compile_regex_cache():
+    regex = grin.compile_regex('foo+', re.MULTILINE)
+    assert regex.pattern == 'foo+' and regex.flags & re.MULTILINE
+    assert grin.compile_regex('foo+', re.MULTILINE) is regex
+    # str and unicode patterns are kept apart even though they compare equal.
+    assert isinstance(grin.compile_regex(u'foo+', re.MULTILINE).pattern,
+        unicode)
+    # The cache does not grow without bound.
+    for i in range(grin._REGEX_CACHE_MAX + 1):
+        grin.compile_regex('foo%d' % i)
+    assert len(grin._REGEX_CACHE) <= grin._REGEX_CACHE_MAX
+
+def test_compile_regex_engine_fallback():
+    # Patterns that the engine rejects are compiled with re instead.
+    class FakeEngine(object):
+        error = ValueError
+        @staticmethod
+        def compile(pattern, flags=0):
+            raise FakeEngine.error('backreferences are not supported')
+    sys.modules['grin_fake_engine'] = FakeEngine
+    try:
+        regex = grin.compile_regex(r'(a)\1', 0, 'grin_fake_engine')
+    finally:
+        del sys.modules['grin_fake_engine']
+    assert isinstance(regex, grin.RE_PATTERN_TYPE)
+    assert regex.search('xaa') is not None
+
+def test_compile_regex_missing_engine():
+    try:
+        grin.compile_regex('foo', 0, 'grin_no_such_engine')
+    except ImportError as e:
+        assert 'grin_no_such_engine' in str(e)
+    else:
+        raise AssertionError('the missing engine was not reported')
+
+def test_color_style_at_runtime():
+    # Changes to COLOR_STYLE take effect in the reports made after them.
+    options = grin.default_options()
+    options.use_color = True
+    g = grin.GrepText(re.compile('foo'), options)
+    context = [(0, grin.MATCH, 'a foo\n', [(2, 5)])]
+    old_style = grin.COLOR_STYLE
+    grin.COLOR_STYLE = dict((name, dict(style))
+        for name, style in old_style.items())
+    try:
+        grin.COLOR_STYLE['searchterm'] = dict(fg='red')
+        report = g.report(context, 'a.txt')
+        assert grin.colorize('foo', fg='red') in report
+        grin.COLOR_STYLE['searchterm']['fg'] = 'blue'
+        report = g.report(context, 'a.txt')
+        assert grin.colorize('foo', fg='blue') in report
+        grin.COLOR_STYLE = dict(filename=dict(bold=True))
+        report = g.report(context, 'a.txt')
+        assert report.startswith(grin.colorize('a.txt:\n', bold=True))
+        assert 'a foo\n' in report
+    finally:
+        grin.COLOR_STYLE = old_style
+
+def test_glob_matcher():
+    # Patterns that match everything need no test at all.
+    assert grin.get_glob_matcher('*') is None
+    assert grin.get_glob_matcher('**') is None
+    # Otherwise the matcher agrees with fnmatch, whether the pattern is
+    # checked by suffix or translated to a regex.
+    names = ['grin.py', 'grin.pyc', '.py', 'py', 'setup.py.orig', 'a.tar.gz',
+        'test', 'text', 'tet', 'atest', 'b.c']
+    patterns = ['*.py', '*.p[yc]', '*.tar.gz', 'te?t*', '[ab]*', '*.*',
+        'test', '', '*t']
+    for pattern in patterns:
+        match = grin.get_glob_matcher(pattern)
+        for name in names:
+            assert bool(match(name)) == fnmatch.fnmatch(name, pattern), \
+                (pattern, name)
+
+def test_files_from_file():
+    f = StringIO(' a.txt\nb c.txt \n\nd.txt')
+    assert list(grin.iter_files_from_file(f)) == ['a.txt', 'b c.txt', '',
+        'd.txt']
+    f = StringIO('a.txt\0b\nc.txt\0')
+    assert list(grin.iter_files_from_file(f, null_separated=True)) == [
+        'a.txt', 'b\nc.txt', '']
+
+def test_files_from_file_blocks():
+    # Names that straddle the reads are carried over to the next block.
+    names = ['name%d.txt' % i for i in range(20)]
+    old_blocksize = grin.FILES_BLOCKSIZE
+    grin.FILES_BLOCKSIZE = 7
+    try:
+        f = StringIO('\0'.join(names))
+        found = list(grin.iter_files_from_file(f, null_separated=True))
+    finally:
+        grin.FILES_BLOCKSIZE = old_blocksize
+    assert found == names
@@ -1,6 +1,8 @@
 """ Test the file recognizer capabilities.
 """
 
+from __future__ import print_function
+
 import gzip
 import os
 import shutil
@@ -9,7 +11,16 @@ import sys
 
 import nose
 
-from grin import FileRecognizer
+from grin import FileRecognizer, get_glob_matcher, is_binary_string
+
+# The contents of the files are built once and written with a single write()
+# each.
+ALL_BYTES = ''.join(map(chr, range(256)))
+TEXT = 'foo\nbar\n' * 100 + 'baz\n' + 'foo\nbar\n' * 100
+
+# Root can read and list everything regardless of permissions, so the fixtures
+# that depend on them are left out of the tree and their tests are skipped.
+PERMISSIONS_APPLY = not (hasattr(os, 'geteuid') and os.geteuid() == 0)
 
 def empty_file(filename, open=open):
     f = open(filename, 'wb')
@@ -17,15 +28,12 @@ def empty_file(filename, open=open):
 
 def binary_file(filename, open=open):
     f = open(filename, 'wb')
-    f.write(''.join(map(chr, range(256))))
+    f.write(ALL_BYTES)
     f.close()
 
 def text_file(filename, open=open):
-    lines = ['foo\n', 'bar\n'] * 100
-    lines.append('baz\n')
-    lines.extend(['foo\n', 'bar\n'] * 100)
     f = open(filename, 'wb')
-    f.writelines(lines)
+    f.write(TEXT)
     f.close()
 
 def fake_gzip_file(filename, open=open):
@@ -34,8 +42,7 @@ def fake_gzip_file(filename, open=open):
     """
     GZIP_MAGIC = '\037\213'
     f = open(filename, 'wb')
-    f.write(GZIP_MAGIC)
-    f.write(''.join(map(chr, range(256))))
+    f.write(GZIP_MAGIC + ALL_BYTES)
     f.close()
 
 def binary_middle(filename, open=open):
@@ -56,25 +63,25 @@ def unreadable_file(filename):
     """ Write a file that does not have read permissions.
     """
     text_file(filename)
-    os.chmod(filename, 0200)
+    os.chmod(filename, 0o200)
 
 def unreadable_dir(filename):
     """ Make a directory that does not have read permissions.
     """
     os.mkdir(filename)
-    os.chmod(filename, 0300)
+    os.chmod(filename, 0o300)
 
 def unexecutable_dir(filename):
     """ Make a directory that does not have execute permissions.
     """
     os.mkdir(filename)
-    os.chmod(filename, 0600)
+    os.chmod(filename, 0o600)
 
 def totally_unusable_dir(filename):
     """ Make a directory that has neither read nor execute permissions.
     """
     os.mkdir(filename)
-    os.chmod(filename, 0100)
+    os.chmod(filename, 0o100)
 
 def setup():
     # Make files to test individual recognizers.
@@ -133,24 +140,26 @@ def setup():
     text_file('tree/skip_dir/text')
     os.mkdir('tree/.skip_hidden_dir')
     text_file('tree/.skip_hidden_file')
-    os.mkdir('tree/unreadable_dir')
-    text_file('tree/unreadable_dir/text')
-    os.chmod('tree/unreadable_dir', 0300)
-    os.mkdir('tree/unexecutable_dir')
-    text_file('tree/unexecutable_dir/text')
-    os.chmod('tree/unexecutable_dir', 0600)
-    os.mkdir('tree/totally_unusable_dir')
-    text_file('tree/totally_unusable_dir/text')
-    os.chmod('tree/totally_unusable_dir', 0100)
-
-def ensure_deletability(arg, dirname, fnames):
-    """ os.path.walk() callback function which will make sure every directory is
-    readable and executable so that it may be easily deleted.
+    if PERMISSIONS_APPLY:
+        os.mkdir('tree/unreadable_dir')
+        text_file('tree/unreadable_dir/text')
+        os.chmod('tree/unreadable_dir', 0o300)
+        os.mkdir('tree/unexecutable_dir')
+        text_file('tree/unexecutable_dir/text')
+        os.chmod('tree/unexecutable_dir', 0o600)
+        os.mkdir('tree/totally_unusable_dir')
+        text_file('tree/totally_unusable_dir/text')
+        os.chmod('tree/totally_unusable_dir', 0o100)
+
+def ensure_deletability(top):
+    """ Make sure every directory under top is readable and executable so that
+    it may be easily deleted.
     """
-    for fn in fnames:
-        fn = os.path.join(dirname, fn)
-        if os.path.isdir(fn):
-            os.chmod(fn, 0700)
+    # os.walk() lists each directory after yielding its parent, so fixing the
+    # permissions here lets it descend into them.
+    for dirname, dirnames, filenames in os.walk(top):
+        for fn in dirnames:
+            os.chmod(os.path.join(dirname, fn), 0o700)
 
 def teardown():
     files_to_delete = ['empty', 'binary', 'binary_middle', 'text', 'text~',
@@ -168,13 +177,19 @@ def teardown():
                 os.unlink(filename)
             else:
                 os.rmdir(filename)
-        except Exception, e:
-            print >>sys.stderr, 'Could not delete %s: %s' % (filename, e)
+        except Exception as e:
+            print('Could not delete %s: %s' % (filename, e), file=sys.stderr)
     os.unlink('socket_test')
-    os.path.walk('tree', ensure_deletability, None)
+    ensure_deletability('tree')
     shutil.rmtree('tree')
 
 
+def test_is_binary_string():
+    assert not is_binary_string('')
+    assert not is_binary_string('foo\tbar\r\n\x1b[0m\x07\x08\x0c\xff')
+    for c in '\x00\x01\x06\x0b\x0e\x1a\x1c\x1f':
+        assert is_binary_string('foo' + c + 'bar')
+
 def test_binary():
     fr = FileRecognizer()
     assert fr.is_binary('binary')
@@ -312,6 +327,8 @@ def test_do_not_skip_hidden_but_skip_symlinks():
     assert fr.recognize_file('.binary.gz') == 'binary'
 
 def test_lack_of_permissions():
+    if not PERMISSIONS_APPLY:
+        raise nose.SkipTest('permissions do not apply to root')
     fr = FileRecognizer()
     assert fr.recognize('unreadable_file') == 'unreadable'
     assert fr.recognize_file('unreadable_file') == 'unreadable'
@@ -323,6 +340,8 @@ def test_lack_of_permissions():
     assert fr.recognize_directory('totally_unusable_dir') == 'directory'
 
 def test_symlink_src_unreadable():
+    if not PERMISSIONS_APPLY:
+        raise nose.SkipTest('permissions do not apply to root')
     fr = FileRecognizer(skip_symlink_files=False, skip_symlink_dirs=False)
     assert fr.recognize('unreadable_file_link') == 'unreadable'
     assert fr.recognize_file('unreadable_file_link') == 'unreadable'
@@ -344,6 +363,14 @@ def test_skip_ext():
     assert fr.recognize('dir.skip_ext') == 'directory'
     assert fr.recognize_directory('dir.skip_ext') == 'directory'
 
+def test_known_exts():
+    fr = FileRecognizer(text_exts=set(['.gz']))
+    assert fr.recognize('fake.gz') == 'text'
+    assert fr.recognize_file('fake.gz') == 'text'
+    fr = FileRecognizer(binary_exts=set(['.dont_skip_ext']))
+    assert fr.recognize('text.dont_skip_ext') == 'binary'
+    assert fr.recognize_file('text.dont_skip_ext') == 'binary'
+
 def test_skip_dir():
     fr = FileRecognizer(skip_dirs=set(['skip_dir', 'fake_skip_dir']))
     assert fr.recognize('skip_dir') == 'skip'
@@ -365,6 +392,25 @@ def test_walking():
     result = sorted(fr.walk('tree'))
     assert result == truth
 
+def test_walking_include_match():
+    fr = FileRecognizer(skip_hidden_files=True, skip_hidden_dirs=True,
+        skip_exts=set(['.skip_ext']),skip_dirs=set(['skip_dir']))
+    # Directories are still descended even though their names do not match.
+    truth = [
+        ('tree/dir.skip_ext/text', 'text'),
+        ('tree/dir/subdir/text', 'text'),
+        ('tree/dir/text', 'text'),
+        ('tree/text', 'text'),
+    ]
+    result = sorted(fr.walk('tree', get_glob_matcher('text')))
+    assert result == truth
+    # The start path is checked too, unless it is a directory.
+    assert list(fr.walk('tree/text', get_glob_matcher('*.py'))) == []
+    assert list(fr.walk('tree/text', get_glob_matcher('te*'))) == [
+        ('tree/text', 'text')]
+    assert sorted(fr.walk('tree/dir', get_glob_matcher('te*'))) == [
+        ('tree/dir/subdir/text', 'text'), ('tree/dir/text', 'text')]
+
 
 def predot():
     os.chdir('tree')
@@ -410,4 +456,15 @@ def test_dot_dot():
     result = sorted(fr.walk('..'))
     assert result == truth
 
-
+def test_walking_is_lazy():
+    # Files are only read to recognize them when the walk reaches them.
+    probed = []
+    class RecordingRecognizer(FileRecognizer):
+        def _recognize_contents(self, filename):
+            probed.append(filename)
+            return FileRecognizer._recognize_contents(self, filename)
+    fr = RecordingRecognizer(skip_hidden_files=True, skip_hidden_dirs=True,
+        skip_exts=set(['.skip_ext']),skip_dirs=set(['skip_dir']))
+    walk = fr.walk('tree')
+    assert next(walk) == ('tree/binary', 'binary')
+    assert probed == ['tree/binary']
@@ -177,6 +177,83 @@ Symmetric 2-line context.
     >>> gt_after_context_1.do_grep(StringIO(middle_of_line))
     [(2, 0, 'barfoobar\n', [(3, 6)]), (3, 1, 'bar\n', None)]
 
+Without color, the spans of the matches are not needed.
+
+    >>> gt_no_color = grin.GrepText(re.compile('foo'), options=grin.Options(before_context=0, after_context=1, use_color=False))
+    >>> gt_no_color.do_grep(StringIO(middle_of_line))
+    [(2, 0, 'barfoobar\n', None), (3, 1, 'bar\n', None)]
+
+Blocks without the literal that every match must contain are skipped.
+
+    >>> grin.get_required_literal(re.compile(r'\bimport\s+os'))
+    'import'
+    >>> grin.get_required_literal(re.compile('foo|bar'))
+    ''
+    >>> grin.get_required_literal(re.compile('foo', re.I))
+    ''
+    >>> gt_literal = grin.GrepText(re.compile(r'\w+foo'))
+    >>> gt_literal.do_grep(StringIO(middle_of_line))
+    [(2, 0, 'barfoobar\n', [(0, 6)])]
+    >>> gt_literal.do_grep(StringIO(no_eol.replace('foo', 'fo')))
+    []
+
+The literal has the same type as the pattern, so unicode patterns can search
+unicode data.
+
+    >>> grin.get_required_literal(re.compile(u'caf\xe9'))
+    u'caf\xe9'
+    >>> gt_unicode = grin.GrepText(re.compile(u'caf\xe9'))
+    >>> from StringIO import StringIO as UnicodeStringIO
+    >>> gt_unicode.do_grep(UnicodeStringIO(u'un caf\xe9\n'))
+    [(0, 0, u'un caf\xe9\n', [(3, 7)])]
+    >>> gt_unicode.has_match(UnicodeStringIO(u'un caf\xe9\n'))
+    True
+
+has_match() only says whether there is any match, which is all that -l and -L
+need.
+
+    >>> gt_default.has_match(StringIO(middle_foo))
+    True
+    >>> gt_default.has_match(StringIO(middle_foo.replace('foo', 'fo')))
+    False
+    >>> gt_default.has_match(StringIO(''))
+    False
+
+It agrees with do_grep(), which does not count the empty match after the final
+newline.
+
+    >>> gt_empty = grin.GrepText(re.compile('^$'))
+    >>> gt_empty.has_match(StringIO('foo\n')), gt_empty.do_grep(StringIO('foo\n'))
+    (False, [])
+    >>> gt_empty.has_match(StringIO('foo\n\nbar\n')), gt_empty.do_grep(StringIO('foo\n\nbar\n'))
+    (True, [(1, 0, '\n', [(0, 0)])])
+
+It keeps reading until it finds a match, even one that straddles the edge of a
+read.
+
+    >>> old_blocksize = grin.READ_BLOCKSIZE
+    >>> grin.READ_BLOCKSIZE = 8
+    >>> gt_default.has_match(StringIO('bar\n' * 5 + 'xxfoo\n'))
+    True
+    >>> gt_default.has_match(StringIO('bar\n' * 5 + 'xxfo\n'))
+    False
+    >>> gt_default.do_grep(StringIO('bar\n' * 5 + 'xxfoo\n'))
+    [(5, 0, 'xxfoo\n', [(2, 5)])]
+    >>> grin.READ_BLOCKSIZE = old_blocksize
+
+get_line_offsets() is no longer used by GrepText, but is kept for other code.
+
+    >>> grin.get_line_offsets(grin.DataBlock('a\nbb\nc', start=0, end=5))
+    ([0, 2, 5, 6], 2)
+
+Likewise uniquify_context(), since do_grep() keeps its context unique itself.
+
+    >>> gt_default.uniquify_context([(2, grin.POST, 'bar\n', None),
+    ...     (1, grin.MATCH, 'foo\n', [(0, 3)]), (2, grin.PRE, 'bar\n', None),
+    ...     (2, grin.MATCH, 'foo\n', [(0, 3)]), (3, grin.PRE, 'bar\n', None),
+    ...     (3, grin.POST, 'baz\n', None)])
+    [(1, 0, 'foo\n', [(0, 3)]), (2, 0, 'foo\n', [(0, 3)]), (3, 1, 'baz\n', None)]
+
 '''
 
 
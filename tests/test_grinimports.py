@@ -0,0 +1,92 @@
+""" Test the import-normalizing cache of the grinimports.py example.
+"""
+
+from cStringIO import StringIO
+import os
+import shutil
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    '..', 'examples'))
+import grinimports
+
+SOURCE = '''\
+import foo
+from foo import bar, baz as bat
+'''
+NORMALIZED = '''\
+import foo
+from foo import bar
+from foo import baz as bat
+'''
+
+# A scratch directory made by setup().
+tmpdir = None
+
+def setup():
+    global tmpdir
+    tmpdir = tempfile.mkdtemp()
+    f = open(os.path.join(tmpdir, 'example.py'), 'wb')
+    f.write(SOURCE)
+    f.close()
+    os.mkdir(os.path.join(tmpdir, 'not_a_file.py'))
+
+def teardown():
+    shutil.rmtree(tmpdir)
+
+def cache_files(cache_dir):
+    """ List the files in a cache directory.
+    """
+    return [os.path.join(dirname, fn)
+        for dirname, dirnames, filenames in os.walk(cache_dir)
+        for fn in filenames]
+
+def test_cached_normalizer():
+    cache_dir = os.path.join(tmpdir, 'cache')
+    filename = os.path.join(tmpdir, 'example.py')
+    normalizer = grinimports.CachedNormalizer(cache_dir)
+    assert normalizer(filename).read() == NORMALIZED
+    cache_path = normalizer.cache_path(filename)
+    assert cache_files(cache_dir) == [cache_path]
+    # A new normalizer reads the entry from the disk rather than parsing the
+    # file again.
+    f = open(cache_path, 'wb')
+    f.write('import cached\n')
+    f.close()
+    normalizer = grinimports.CachedNormalizer(cache_dir)
+    assert normalizer(filename).read() == 'import cached\n'
+
+def test_cached_normalizer_read_failure():
+    # A file that cannot be read is not cached as empty.
+    cache_dir = os.path.join(tmpdir, 'cache_read_failure')
+    filename = os.path.join(tmpdir, 'not_a_file.py')
+    normalizer = grinimports.CachedNormalizer(cache_dir)
+    assert normalizer(filename).read() == ''
+    assert cache_files(cache_dir) == []
+    assert normalizer._by_path == {}
+
+def test_cached_normalizer_write_failure():
+    # A failed write does not leave its temporary file behind.
+    cache_dir = os.path.join(tmpdir, 'cache_write_failure')
+    cache_path = os.path.join(cache_dir, 'entry')
+    # Renaming onto a directory fails.
+    os.makedirs(cache_path)
+    normalizer = grinimports.CachedNormalizer(cache_dir)
+    normalizer.write_entry(cache_path, NORMALIZED)
+    assert os.listdir(cache_dir) == ['entry']
+    assert os.listdir(cache_path) == []
+
+def test_no_cache():
+    cache_dir = os.path.join(tmpdir, 'cache_unused')
+    filename = os.path.join(tmpdir, 'example.py')
+    old_stdout = sys.stdout
+    sys.stdout = StringIO()
+    try:
+        grinimports.grinimports_main(['grinimports.py', '--no-color',
+            '--no-cache', '--cache-dir', cache_dir, 'import foo$', filename])
+        output = sys.stdout.getvalue()
+    finally:
+        sys.stdout = old_stdout
+    assert output == '%s:\n    1 : import foo\n' % filename
+    assert not os.path.exists(cache_dir)